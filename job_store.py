@@ -0,0 +1,402 @@
+"""
+Job persistence for the GSTR-2B service: the in-memory JobStore and the
+SQLite-backed SqliteJobStore shared by all worker processes on a host.
+"""
+
+import os
+import time
+import json
+import sqlite3
+import socket
+import itertools
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+MONTH_PENDING = "PENDING"
+MONTH_RUNNING = "RUNNING"
+MONTH_COMPLETED = "COMPLETED"
+MONTH_FAILED = "FAILED"
+MONTH_RETRYING = "RETRYING"
+MONTH_FAILED_AGAIN = "FAILED_AGAIN"
+
+JOB_STORE_PATH = os.environ.get("GSTR2B_JOB_STORE", str(Path.home() / ".gstr2b_cache" / "jobs.sqlite3"))  # or "memory"
+JOB_INTERRUPTED = "INTERRUPTED"
+_STORED_FINAL = ("COMPLETED", "FAILED", JOB_INTERRUPTED)
+_HOSTNAME = socket.gethostname()
+
+
+def _job_owner() -> str:
+    return f"{_HOSTNAME}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # os.kill(pid, 0) on Windows sends CTRL_C_EVENT; ask the kernel instead
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.OpenProcess.restype = wintypes.HANDLE
+        handle = kernel32.OpenProcess(0x1000, False, pid)   # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return ctypes.get_last_error() == 5   # ERROR_ACCESS_DENIED: it exists
+        try:
+            code = wintypes.DWORD()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            return code.value == 259   # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:   # ProcessLookupError, or anything else: treat as gone
+        return False
+    return True
+
+
+def _interrupted(status: dict) -> dict:
+    """The last status of a job whose process died, as shown until it is resumed or expires."""
+    for months in [status.get("months") or {}] + [f.get("months") or {} for f in (status.get("fys") or {}).values()]:
+        for m, st in months.items():
+            if st != MONTH_COMPLETED:
+                months[m] = MONTH_PENDING
+    for k in ("queue_position", "estimated_start", "estimated_wait_seconds", "captcha"):
+        status.pop(k, None)
+    status.update(status=JOB_INTERRUPTED, stage=JOB_INTERRUPTED,
+                  error="The server restarted while this job was running. Resume it to fetch the remaining months.")
+    return status
+
+
+def _resumable(status: dict) -> dict:
+    status.update(status="QUEUED", stage="QUEUED")
+    status.pop("error", None)
+    return status
+
+
+class JobStore:
+    """
+    Job persistence interface. This base class keeps everything in process
+    memory, so it only serves one process and forgets jobs on restart.
+    Statuses are JSON-able snapshots; `spec` is the job's vals without the
+    password, kept for resuming.
+    """
+
+    shared = False   # True if other processes see the same jobs (needed for worker processes)
+
+    def __init__(self):
+        self._jobs = {}       # job_id -> {"status", "version", "final", "updated_at", "owner", "kind", "spec"}
+        self._commands = []   # (job_id, command, payload)
+        self._queue = []      # sorted (-priority, seq, job_id, kind, vals)
+        self._queue_seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _row(self, job_id) -> dict:
+        return self._jobs.setdefault(job_id, {"status": {}, "version": 0, "final": False, "updated_at": time.time(),
+                                              "owner": _job_owner(), "kind": None, "spec": None})
+
+    def save(self, job_id, status: dict):
+        with self._lock:
+            row = self._row(job_id)
+            row.update(status=status, version=row["version"] + 1, final=status.get("status") in _STORED_FINAL,
+                       updated_at=time.time(), owner=_job_owner())
+
+    def save_spec(self, job_id, kind: str, spec: dict):
+        with self._lock:
+            self._row(job_id).update(kind=kind, spec=spec)
+
+    def load(self, job_id):
+        """(version, status), or None for an unknown job."""
+        row = self._jobs.get(job_id)
+        return (row["version"], row["status"]) if row and row["version"] else None
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._commands = [c for c in self._commands if c[0] != job_id]
+
+    def expired(self, before: float) -> list:
+        """(job_id, status) of finished jobs last changed before `before`."""
+        return [(job_id, row["status"]) for job_id, row in list(self._jobs.items())
+                if row["final"] and row["updated_at"] < before]
+
+    def claim_orphans(self) -> list:
+        """Mark unfinished jobs of dead processes on this host INTERRUPTED; returns their ids."""
+        return []
+
+    def claim_resume(self, job_id):
+        """Take over an INTERRUPTED job: (status, kind, spec), or None if it cannot be resumed."""
+        with self._lock:
+            row = self._jobs.get(job_id)
+            if not row or row["status"].get("status") != JOB_INTERRUPTED or not row["kind"]:
+                return None
+            row.update(status=_resumable(row["status"]), final=False, owner=_job_owner())
+            return row["status"], row["kind"], row["spec"]
+
+    def post_command(self, job_id, command: str, payload=None):
+        with self._lock:
+            self._commands.append((job_id, command, payload))
+
+    def take_commands(self, job_ids) -> list:
+        wanted = set(job_ids)
+        with self._lock:
+            taken = [c for c in self._commands if c[0] in wanted]
+            self._commands = [c for c in self._commands if c[0] not in wanted]
+        return taken
+
+    def enqueue(self, job_id, priority: int, kind: str, vals: dict, limit: int = None) -> bool:
+        """Queue a job for the worker processes. False if `limit` jobs are already waiting."""
+        with self._lock:
+            if limit is not None and len(self._queue) >= limit:
+                return False
+            self._queue.append((-priority, next(self._queue_seq), job_id, kind, vals))
+            self._queue.sort(key=lambda e: e[:2])
+            return True
+
+    def claim_queued(self):
+        """Take the next queued job for this process: (job_id, kind, vals), or None."""
+        with self._lock:
+            if not self._queue:
+                return None
+            _, _, job_id, kind, vals = self._queue.pop(0)
+            self._row(job_id)["owner"] = _job_owner()
+            return job_id, kind, vals
+
+    def dequeue(self, job_id) -> bool:
+        with self._lock:
+            kept = [e for e in self._queue if e[2] != job_id]
+            removed = len(kept) != len(self._queue)
+            self._queue = kept
+            return removed
+
+    def queue_position(self, job_id):
+        for pos, entry in enumerate(list(self._queue), start=1):
+            if entry[2] == job_id:
+                return pos
+        return None
+
+    def job_counts(self) -> dict:
+        """Unfinished jobs by status."""
+        counts = {}
+        for row in list(self._jobs.values()):
+            if row["version"] and not row["final"]:
+                state = row["status"].get("status")
+                counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def save_metrics(self, owner: str, snapshot: dict):
+        pass   # a single process: /metrics reads its own counters
+
+    def load_metrics(self, exclude_owner: str = None) -> list:
+        """Metric snapshots published by other processes."""
+        return []
+
+    def delete_metrics(self, owner: str):
+        """Drop the snapshot `owner` published, e.g. once that worker has died."""
+
+    def prune_metrics(self) -> int:
+        """Drop the snapshots of dead processes on this host; returns how many."""
+        return 0
+
+
+_JOB_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id     TEXT PRIMARY KEY,
+    owner      TEXT,
+    status     TEXT NOT NULL DEFAULT '{}',
+    version    INTEGER NOT NULL DEFAULT 0,
+    final      INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    kind       TEXT,
+    spec       TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_final ON jobs (final, updated_at);
+CREATE TABLE IF NOT EXISTS job_commands (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id  TEXT NOT NULL,
+    command TEXT NOT NULL,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS job_commands_job ON job_commands (job_id);
+CREATE TABLE IF NOT EXISTS job_queue (
+    seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id   TEXT NOT NULL UNIQUE,
+    priority INTEGER NOT NULL DEFAULT 0,
+    kind     TEXT NOT NULL,
+    vals     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_queue_order ON job_queue (priority DESC, seq);
+CREATE TABLE IF NOT EXISTS metrics (
+    owner      TEXT PRIMARY KEY,
+    data       TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SqliteJobStore(JobStore):
+    """JobStore in one SQLite file (WAL mode), shared by every worker process on the machine."""
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self._local = threading.local()   # one connection per thread (and per process after a fork)
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            try:
+                os.chmod(self.path, 0o600)   # queued jobs carry their portal password
+            except OSError:
+                pass
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA secure_delete=ON")   # a claimed queue row is zeroed, not just unlinked
+            db.executescript(_JOB_STORE_SCHEMA)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def save(self, job_id, status: dict):
+        self._db().execute(
+            "INSERT INTO jobs (job_id, owner, status, version, final, updated_at) VALUES (?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT (job_id) DO UPDATE SET owner = excluded.owner, status = excluded.status, "
+            "version = jobs.version + 1, final = excluded.final, updated_at = excluded.updated_at",
+            (job_id, _job_owner(), json.dumps(status, default=str), status.get("status") in _STORED_FINAL, time.time()))
+
+    def save_spec(self, job_id, kind: str, spec: dict):
+        self._db().execute(
+            "INSERT INTO jobs (job_id, owner, updated_at, kind, spec) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (job_id) DO UPDATE SET kind = excluded.kind, spec = excluded.spec",
+            (job_id, _job_owner(), time.time(), kind, json.dumps(spec, default=str)))
+
+    def load(self, job_id):
+        row = self._db().execute("SELECT version, status FROM jobs WHERE job_id = ? AND version > 0",
+                                 (job_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def delete(self, job_id):
+        with self._transaction() as db:
+            db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            db.execute("DELETE FROM job_commands WHERE job_id = ?", (job_id,))
+
+    def expired(self, before: float) -> list:
+        rows = self._db().execute("SELECT job_id, status FROM jobs WHERE final = 1 AND updated_at < ?", (before,))
+        return [(job_id, json.loads(status)) for job_id, status in rows.fetchall()]
+
+    def claim_orphans(self) -> list:
+        claimed = []
+        with self._transaction() as db:
+            for job_id, owner, status in db.execute("SELECT job_id, owner, status FROM jobs WHERE final = 0 AND job_id "
+                                                    "NOT IN (SELECT job_id FROM job_queue)").fetchall():
+                host, _, pid = (owner or "").rpartition(":")
+                if host != _HOSTNAME or not pid.isdigit() or _pid_alive(int(pid)):
+                    continue   # still running, or owned by another machine
+                db.execute("UPDATE jobs SET status = ?, version = version + 1, final = 1, updated_at = ? WHERE job_id = ?",
+                           (json.dumps(_interrupted(json.loads(status))), time.time(), job_id))
+                claimed.append(job_id)
+        return claimed
+
+    def claim_resume(self, job_id):
+        with self._transaction() as db:
+            row = db.execute("SELECT status, kind, spec FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if not row or not row[1] or json.loads(row[0]).get("status") != JOB_INTERRUPTED:
+                return None
+            status = _resumable(json.loads(row[0]))
+            db.execute("UPDATE jobs SET owner = ?, status = ?, version = version + 1, final = 0, updated_at = ? "
+                       "WHERE job_id = ?", (_job_owner(), json.dumps(status), time.time(), job_id))
+        return status, row[1], json.loads(row[2])
+
+    def post_command(self, job_id, command: str, payload=None):
+        self._db().execute("INSERT INTO job_commands (job_id, command, payload) VALUES (?, ?, ?)",
+                           (job_id, command, json.dumps(payload)))
+
+    def take_commands(self, job_ids) -> list:
+        job_ids = list(job_ids)
+        if not job_ids:
+            return []
+        marks = ",".join("?" * len(job_ids))
+        with self._transaction() as db:
+            rows = db.execute(f"SELECT id, job_id, command, payload FROM job_commands WHERE job_id IN ({marks}) "
+                              "ORDER BY id", job_ids).fetchall()
+            if rows:
+                db.execute(f"DELETE FROM job_commands WHERE id IN ({','.join('?' * len(rows))})", [r[0] for r in rows])
+        return [(job_id, command, json.loads(payload)) for _, job_id, command, payload in rows]
+
+    def enqueue(self, job_id, priority: int, kind: str, vals: dict, limit: int = None) -> bool:
+        with self._transaction() as db:
+            if limit is not None and db.execute("SELECT COUNT(*) FROM job_queue").fetchone()[0] >= limit:
+                return False
+            db.execute("INSERT INTO job_queue (job_id, priority, kind, vals) VALUES (?, ?, ?, ?)",
+                       (job_id, priority, kind, json.dumps(vals, default=str)))
+        return True
+
+    def claim_queued(self):
+        with self._transaction() as db:
+            row = db.execute("SELECT seq, job_id, kind, vals FROM job_queue ORDER BY priority DESC, seq LIMIT 1").fetchone()
+            if not row:
+                return None
+            db.execute("DELETE FROM job_queue WHERE seq = ?", (row[0],))
+            db.execute("UPDATE jobs SET owner = ? WHERE job_id = ?", (_job_owner(), row[1]))
+        # The WAL still holds the row's password until a checkpoint; copy it
+        # back and truncate the WAL now (best effort: readers may hold it open)
+        try:
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error:
+            pass
+        return row[1], row[2], json.loads(row[3])
+
+    def dequeue(self, job_id) -> bool:
+        return self._db().execute("DELETE FROM job_queue WHERE job_id = ?", (job_id,)).rowcount > 0
+
+    def job_counts(self) -> dict:
+        rows = self._db().execute("SELECT json_extract(status, '$.status'), COUNT(*) FROM jobs "
+                                  "WHERE final = 0 AND version > 0 GROUP BY 1").fetchall()
+        return dict(rows)
+
+    def save_metrics(self, owner: str, snapshot: dict):
+        self._db().execute("INSERT INTO metrics (owner, data, updated_at) VALUES (?, ?, ?) ON CONFLICT (owner) "
+                           "DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                           (owner, json.dumps(snapshot), time.time()))
+
+    def load_metrics(self, exclude_owner: str = None) -> list:
+        rows = self._db().execute("SELECT data FROM metrics WHERE owner IS NOT ?", (exclude_owner,)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def delete_metrics(self, owner: str):
+        self._db().execute("DELETE FROM metrics WHERE owner = ?", (owner,))
+
+    def prune_metrics(self) -> int:
+        dead = []
+        for (owner,) in self._db().execute("SELECT owner FROM metrics").fetchall():
+            host, _, pid = owner.rpartition(":")
+            if host == _HOSTNAME and pid.isdigit() and not _pid_alive(int(pid)):
+                dead.append(owner)
+        if dead:
+            self._db().execute(f"DELETE FROM metrics WHERE owner IN ({','.join('?' * len(dead))})", dead)
+        return len(dead)
+
+    def queue_position(self, job_id):
+        row = self._db().execute(
+            "SELECT COUNT(*) FROM job_queue q, (SELECT priority, seq FROM job_queue WHERE job_id = ?) me "
+            "WHERE q.priority > me.priority OR (q.priority = me.priority AND q.seq <= me.seq)", (job_id,)).fetchone()
+        return row[0] or None
+
+
+def open_job_store(path: str = None) -> JobStore:
+    path = JOB_STORE_PATH if path is None else path
+    return JobStore() if path == "memory" else SqliteJobStore(path)
@@ -1,49 +1,345 @@
+import sys
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import gspread
+from google.auth.transport.requests import Request
 from oauth2client.service_account import ServiceAccountCredentials
 
 app = Flask(__name__)
 CORS(app, origins=["https://wsaksham1997.github.io"])
 
 # ---------------- GOOGLE SHEET CONNECT ---------------- #
-def connect_sheet():
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/drive"
-    ]
-
-    creds = ServiceAccountCredentials.from_json_keyfile_name(
-        r"D:\akgvg233saksham\Data\Software\New Creation\gst-backend\API Key\credentials.json",
-        scope
-    )
+SHEET_SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive"
+]
+SHEET_KEYFILE = r"D:\akgvg233saksham\Data\Software\New Creation\gst-backend\API Key\credentials.json"
+SHEET_URL = "https://docs.google.com/spreadsheets/d/1tt2jKGGNw3sMsmF1mtdhh1fh05XouHN_cBerlihHvFU/edit"
+TOKEN_REFRESH_MARGIN = 300    # refresh the access token when it has less than this left
+
 
+def authorize_gspread():
+    """Default client factory: returns (worksheet, credentials)."""
+    creds = ServiceAccountCredentials.from_json_keyfile_name(SHEET_KEYFILE, SHEET_SCOPE)
     client = gspread.authorize(creds)
+    # gspread 6 signs its requests with a google-auth copy of `creds`; that
+    # copy holds the live token, so it is the one to watch and refresh
+    return client.open_by_url(SHEET_URL).sheet1, client.http_client.auth
+
+
+# Builds the worksheet handle. Swap for a stand-in (see StandInSheetClient)
+# to run against a local server instead of Google.
+SHEET_CLIENT_FACTORY = authorize_gspread
+
+# One authorized client per process, shared by every gunicorn worker thread so
+# the key-file parse, token mint and TLS handshakes happen once, not per login.
+_SHEET_CLIENT = {"sheet": None, "creds": None}
+_SHEET_CLIENT_LOCK = threading.Lock()
+
+SHEET_CLIENT_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "token_refreshes": 0,
+    "errors": 0,
+    "fetches": 0,
+    "fetch_seconds_total": 0.0,
+    "fetch_seconds_max": 0.0,
+    "last_fetch_seconds": 0.0,
+}
+
+
+def _token_near_expiry(creds):
+    expiry = getattr(creds, "expiry", None)
+    if expiry is None:
+        return False
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)   # google-auth keeps it as naive UTC
+    return (expiry - datetime.now(timezone.utc)).total_seconds() < TOKEN_REFRESH_MARGIN
+
 
-    sheet = client.open_by_url(
-        "https://docs.google.com/spreadsheets/d/1tt2jKGGNw3sMsmF1mtdhh1fh05XouHN_cBerlihHvFU/edit"
-    ).sheet1
+def _refresh_token(creds):
+    # The client's AuthorizedSession reads the token from `creds` on every
+    # request, so refreshing it in place is enough
+    creds.refresh(Request())
+    SHEET_CLIENT_STATS["token_refreshes"] += 1
+
+
+def get_sheet():
+    with _SHEET_CLIENT_LOCK:
+        sheet = _SHEET_CLIENT["sheet"]
+        if sheet is None:
+            SHEET_CLIENT_STATS["misses"] += 1
+            sheet, creds = SHEET_CLIENT_FACTORY()
+            _SHEET_CLIENT["sheet"] = sheet
+            _SHEET_CLIENT["creds"] = creds
+            return sheet
+
+        SHEET_CLIENT_STATS["hits"] += 1
+        creds = _SHEET_CLIENT["creds"]
+        if creds is not None and _token_near_expiry(creds):
+            try:
+                _refresh_token(creds)
+            except Exception as e:
+                print("TOKEN REFRESH ERROR:", str(e))
+        return sheet
+
+
+def reset_sheet_client():
+    with _SHEET_CLIENT_LOCK:
+        _SHEET_CLIENT["sheet"] = None
+        _SHEET_CLIENT["creds"] = None
+
+
+def connect_sheet():
+    start = time.perf_counter()
+    try:
+        try:
+            records = get_sheet().get_all_records()
+        except Exception:
+            # Stale session or revoked token: rebuild the client once
+            with _SHEET_CLIENT_LOCK:
+                SHEET_CLIENT_STATS["errors"] += 1
+            reset_sheet_client()
+            records = get_sheet().get_all_records()
+    finally:
+        elapsed = time.perf_counter() - start
+        with _SHEET_CLIENT_LOCK:
+            SHEET_CLIENT_STATS["fetches"] += 1
+            SHEET_CLIENT_STATS["fetch_seconds_total"] += elapsed
+            SHEET_CLIENT_STATS["last_fetch_seconds"] = elapsed
+            SHEET_CLIENT_STATS["fetch_seconds_max"] = max(SHEET_CLIENT_STATS["fetch_seconds_max"], elapsed)
 
-    return sheet.get_all_records()
+    return records
+
+
+# ---------------- LOCAL SHEETS API STAND-IN ---------------- #
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so connection reuse is visible
+
+    def do_GET(self):
+        server = self.server
+        server.requests_seen += 1
+        server.connections_seen.add(self.client_address)
+        if server.latency:
+            time.sleep(server.latency)
+        # Same shape as GET /v4/spreadsheets/<id>/values/<range>
+        body = json.dumps({"range": "Sheet1", "majorDimension": "ROWS", "values": server.values}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_sheets_stand_in(records, port=0, latency=0.0):
+    """Serve `records` like the Sheets values API on localhost; returns the server."""
+    header = list(records[0].keys()) if records else ["Login ID", "Password"]
+    server = ThreadingHTTPServer(("127.0.0.1", port), _StandInHandler)
+    server.values = [header] + [[r.get(h, "") for h in header] for r in records]
+    server.latency = latency
+    server.requests_seen = 0
+    server.connections_seen = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StandInSheetClient:
+    """Worksheet look-alike that reads from start_sheets_stand_in() over a pooled session."""
+
+    def __init__(self, base_url):
+        import requests
+        self.url = base_url.rstrip("/") + "/v4/spreadsheets/stand-in/values/Sheet1"
+        self.session = requests.Session()
+
+    def get_all_records(self):
+        resp = self.session.get(self.url, timeout=10)
+        resp.raise_for_status()
+        values = resp.json().get("values", [])
+        if not values:
+            return []
+        header = values[0]
+        return [dict(zip(header, row)) for row in values[1:]]
+
+
+# ---------------- CREDENTIAL CACHE ---------------- #
+# Login IDs are indexed in memory so /login is a dict lookup instead of a
+# sheet download + linear scan. The index is reloaded from the sheet when it
+# goes past CRED_CACHE_TTL (in the foreground), refreshed in the background
+# shortly before that, and reloaded on a miss so newly added users can log in
+# without waiting for the TTL. All reloads are single-flight.
+CRED_CACHE_TTL = 300          # seconds an index is served without reloading
+CRED_REFRESH_AHEAD = 60       # start a background refresh this long before expiry
+CRED_MISS_RELOAD_AFTER = 30   # min index age before a miss forces a reload
+
+# Anything returning the sheet rows as a list of dicts (see FakeSheetProvider)
+RECORDS_PROVIDER = connect_sheet
+
+_CRED_STATE = {"index": None, "loaded_at": 0.0, "refreshing": False}
+_CRED_LOAD_LOCK = threading.Lock()
+
+
+def normalize_login_id(login_id):
+    return str(login_id).strip()
+
+
+def build_credential_index(records):
+    index = {}
+    for row in records:
+        key = normalize_login_id(row['Login ID'])
+        index.setdefault(key, set()).add(str(row['Password']).strip())
+    return index
+
+
+def _reload_credentials(if_older_than):
+    """
+    Reload the index unless another thread already did it after `if_older_than`.
+    Callers that queue up on the lock while a reload is in flight all share
+    that one fetch.
+    """
+    with _CRED_LOAD_LOCK:
+        if _CRED_STATE["index"] is not None and _CRED_STATE["loaded_at"] > if_older_than:
+            return _CRED_STATE["index"]
+        index = build_credential_index(RECORDS_PROVIDER())
+        _CRED_STATE["index"] = index
+        _CRED_STATE["loaded_at"] = time.monotonic()
+        return index
+
+
+def _background_refresh():
+    try:
+        _reload_credentials(time.monotonic() - CRED_REFRESH_AHEAD)
+    except Exception as e:
+        print("CREDENTIAL REFRESH ERROR:", str(e))
+    finally:
+        _CRED_STATE["refreshing"] = False
+
+
+def get_credential_index():
+    now = time.monotonic()
+    index = _CRED_STATE["index"]
+    age = now - _CRED_STATE["loaded_at"]
+
+    if index is None or age >= CRED_CACHE_TTL:
+        return _reload_credentials(now - CRED_CACHE_TTL)
+
+    if age >= CRED_CACHE_TTL - CRED_REFRESH_AHEAD and not _CRED_STATE["refreshing"]:
+        _CRED_STATE["refreshing"] = True
+        threading.Thread(target=_background_refresh, daemon=True).start()
+
+    return index
+
+
+def invalidate_credential_cache():
+    with _CRED_LOAD_LOCK:
+        _CRED_STATE["index"] = None
+        _CRED_STATE["loaded_at"] = 0.0
+
+
+class FakeSheetProvider:
+    """Local stand-in for connect_sheet(), for benchmarks and offline runs."""
+
+    def __init__(self, n_users=1000, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.records = [
+            {"Login ID": f"user{i}", "Password": f"pass{i}"} for i in range(n_users)
+        ]
+
+    def __call__(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return list(self.records)
 
 
 # ---------------- LOGIN VALIDATION ---------------- #
 def validate_login(login_id, password):
-    records = connect_sheet()
+    key = normalize_login_id(login_id)
+    password = str(password).strip()
 
-    for row in records:
-        if str(row['Login ID']).strip() == login_id and str(row['Password']).strip() == password:
-            return True
+    index = get_credential_index()
+    if password in index.get(key, ()):
+        return True
+
+    # Unknown user or changed password: the sheet may be newer than the index
+    loaded_at = _CRED_STATE["loaded_at"]
+    if time.monotonic() - loaded_at >= CRED_MISS_RELOAD_AFTER:
+        index = _reload_credentials(loaded_at)
+        return password in index.get(key, ())
 
     return False
 
 
+def benchmark_validate_login(n_users=5000, n_logins=2000, n_threads=16, latency=0.5):
+    """Burst of logins against FakeSheetProvider: old scan-per-request vs. cached index."""
+    global RECORDS_PROVIDER
+    provider = FakeSheetProvider(n_users=n_users, latency=latency)
+    saved = RECORDS_PROVIDER
+    RECORDS_PROVIDER = provider
+    invalidate_credential_cache()
+    ids = [(f"user{i % n_users}", f"pass{i % n_users}") for i in range(n_logins)]
+
+    def scan_login(login_id, password):
+        for row in provider.records:
+            if str(row['Login ID']).strip() == login_id and str(row['Password']).strip() == password:
+                return True
+        return False
+
+    try:
+        start = time.perf_counter()
+        for login_id, password in ids:
+            scan_login(login_id, password)
+        scan_only = time.perf_counter() - start
+        print(f"linear scan only (no sheet fetch): {n_logins} logins in {scan_only:.3f}s")
+        print(f"old path incl. fetch (estimated):  {n_logins * latency + scan_only:.1f}s")
+
+        chunks = [ids[i::n_threads] for i in range(n_threads)]
+
+        def worker(chunk):
+            for login_id, password in chunk:
+                assert validate_login(login_id, password)
+
+        threads = [threading.Thread(target=worker, args=(c,)) for c in chunks]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        cached = time.perf_counter() - start
+        print(f"cached index ({n_threads} threads, cold start): {n_logins} logins in {cached:.3f}s, "
+              f"sheet fetches: {provider.calls}")
+    finally:
+        RECORDS_PROVIDER = saved
+        invalidate_credential_cache()
+
+
 # ---------------- ROOT ROUTE ---------------- #
 @app.route("/")
 def home():
     return "Login API Running"
 
 
+# ---------------- SHEET CLIENT STATS ---------------- #
+@app.route("/sheet-client-stats")
+def sheet_client_stats():
+    with _SHEET_CLIENT_LOCK:
+        stats = dict(SHEET_CLIENT_STATS)
+    fetches = stats["fetches"]
+    stats["fetch_seconds_avg"] = stats["fetch_seconds_total"] / fetches if fetches else 0.0
+    stats["credential_index_age"] = (
+        time.monotonic() - _CRED_STATE["loaded_at"] if _CRED_STATE["index"] is not None else None
+    )
+    return jsonify(stats)
+
+
 # ---------------- LOGIN API ---------------- #
 @app.route("/login", methods=["POST"])
 def login():
@@ -69,8 +365,43 @@ def login():
         return jsonify({"status":"error","message":str(e)}), 500
 
 
+def benchmark_sheet_client(n_users=2000, n_fetches=200, n_threads=8):
+    """Repeated sheet fetches through the shared client against the local stand-in."""
+    global SHEET_CLIENT_FACTORY
+    records = [{"Login ID": f"user{i}", "Password": f"pass{i}"} for i in range(n_users)]
+    server = start_sheets_stand_in(records)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    saved = SHEET_CLIENT_FACTORY
+    SHEET_CLIENT_FACTORY = lambda: (StandInSheetClient(base_url), None)
+    reset_sheet_client()
+
+    def worker(n):
+        for _ in range(n):
+            assert len(connect_sheet()) == n_users
+
+    try:
+        threads = [threading.Thread(target=worker, args=(n_fetches // n_threads,)) for _ in range(n_threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        print(f"{server.requests_seen} fetches in {elapsed:.3f}s over "
+              f"{len(server.connections_seen)} TCP connections")
+        print("stats:", SHEET_CLIENT_STATS)
+    finally:
+        SHEET_CLIENT_FACTORY = saved
+        reset_sheet_client()
+        server.shutdown()
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001)
+    if "--bench" in sys.argv:
+        benchmark_validate_login()
+        benchmark_sheet_client()
+    else:
+        app.run(host="0.0.0.0", port=5001)
 
 
 
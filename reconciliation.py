@@ -0,0 +1,151 @@
+"""
+ITC reconciliation of GSTR-2B B2B rows against a purchase register.
+"""
+
+import os
+from pathlib import Path
+
+import pandas as pd
+
+# Matches the FY's GSTR-2B B2B rows against a purchase register. Both sides
+# are first reduced to one row per (supplier GSTIN, invoice), then joined
+# with pandas hash merges: on the normalized invoice number, and for what is
+# left, on the invoice number's last digit run plus an amount check. No row
+# is ever compared with another in a Python loop.
+RECON_AMOUNT_TOLERANCE = float(os.environ.get("GSTR2B_RECON_AMOUNT_TOLERANCE", "1.0"))   # ₹, per invoice
+RECON_DATE_TOLERANCE_DAYS = int(os.environ.get("GSTR2B_RECON_DATE_DAYS", "3"))
+RECON_TAXES = ["Integrated Tax (₹)", "Central Tax (₹)", "State/UT Tax (₹)", "Cess (₹)"]
+RECON_AMOUNTS = ["Taxable Value (₹)"] + RECON_TAXES
+
+
+def _text(col: pd.Series) -> pd.Series:
+    """Arrow-backed strings where pyarrow is installed, so the .str regexes below run in RE2, not per row in Python."""
+    try:
+        return col.astype("string[pyarrow]")
+    except ImportError:
+        return col.astype("string")
+
+
+def _gstin_key(col: pd.Series) -> pd.Series:
+    return _text(col).str.upper().str.replace(r"[^0-9A-Z]", "", regex=True).fillna("")
+
+
+def _invoice_key(col: pd.Series) -> pd.Series:
+    """'inv/0045', 'INV-45' and 'INV 045' -> 'INV45'."""
+    key = _text(col).str.upper().str.replace(r"[^0-9A-Z]", "", regex=True)
+    return key.str.replace(r"(^|[^0-9])0+([0-9])", r"\1\2", regex=True).fillna("")
+
+
+def _invoice_core(col: pd.Series) -> pd.Series:
+    """Last digit run of an invoice number once FY fragments are gone: 'GST/2023-24/0045' -> '45'."""
+    text = _text(col).str.replace(r"(^|[^0-9])(?:20)?[0-9]{2}\s*[-/]\s*(?:20)?[0-9]{2}($|[^0-9])", r"\1 \2", regex=True)
+    core = text.str.extract(r"([0-9]+)[^0-9]*$", expand=False).str.lstrip("0")
+    return core.where(core != "")
+
+
+def _invoice_level(df: pd.DataFrame, extra=()) -> pd.DataFrame:
+    """One row per (GSTIN, invoice key); line amounts summed (the 2B has a row per tax rate)."""
+    keyed = pd.DataFrame({
+        "gstin": _gstin_key(df["GSTIN of supplier"]),
+        "inv_key": _invoice_key(df["Invoice number"]),
+    })
+    cols = ["GSTIN of supplier", "Trade/Legal name", "Invoice number", "Invoice Date"] + list(extra)
+    for c in cols + RECON_AMOUNTS:
+        keyed[c] = df[c].values if c in df.columns else None
+    # Only invoices with several lines need a group-by; the rest are already one row each
+    dup = keyed.duplicated(["gstin", "inv_key"], keep=False)
+    inv = keyed[~dup]
+    if dup.any():
+        agg = {c: "first" for c in cols}
+        agg.update({c: "sum" for c in RECON_AMOUNTS})
+        grouped = keyed[dup].groupby(["gstin", "inv_key"], sort=False, observed=True).agg(agg).reset_index()
+        inv = pd.concat([inv, grouped], ignore_index=True)
+    inv = inv.reset_index(drop=True)
+    inv["Total Tax (₹)"] = inv[RECON_TAXES].sum(axis=1)
+    return inv
+
+
+def _compare(pairs: pd.DataFrame, amount_tolerance: float, date_tolerance_days: int) -> pd.DataFrame:
+    pairs["Taxable diff (₹)"] = (pairs["Taxable Value (₹) (books)"] - pairs["Taxable Value (₹) (2B)"]).round(2)
+    pairs["Tax diff (₹)"] = (pairs["Total Tax (₹) (books)"] - pairs["Total Tax (₹) (2B)"]).round(2)
+    pairs["Date diff (days)"] = (pd.to_datetime(pairs["Invoice Date (books)"])
+                                 - pd.to_datetime(pairs["Invoice Date (2B)"])).dt.days
+    bad_taxable = pairs["Taxable diff (₹)"].abs() > amount_tolerance
+    bad_tax = pairs["Tax diff (₹)"].abs() > amount_tolerance
+    bad_date = pairs["Date diff (days)"].abs() > date_tolerance_days
+    pairs["Reason"] = (bad_taxable.map({True: "Taxable value; ", False: ""})
+                       + bad_tax.map({True: "Tax amount; ", False: ""})
+                       + bad_date.map({True: "Invoice date; ", False: ""})).str.rstrip("; ")
+    return pairs
+
+
+def reconcile_itc(b2b: pd.DataFrame, register: pd.DataFrame, amount_tolerance: float = None,
+                  date_tolerance_days: int = None) -> dict:
+    """
+    Match purchase-register invoices with GSTR-2B B2B invoices.
+    Returns {sheet name: DataFrame} for Summary, Matched, Mismatched,
+    Missing in books (in the 2B only) and Missing in 2B (in the register only).
+    """
+    tol = RECON_AMOUNT_TOLERANCE if amount_tolerance is None else amount_tolerance
+    days = RECON_DATE_TOLERANCE_DAYS if date_tolerance_days is None else date_tolerance_days
+    books = _invoice_level(register)
+    twob = _invoice_level(b2b, extra=[c for c in ("Month", "ITC Availability") if c in b2b.columns])
+    books["_b"] = range(len(books))
+    twob["_t"] = range(len(twob))
+
+    # Pass 1: same GSTIN and normalized invoice number
+    exact = books.merge(twob, on=["gstin", "inv_key"], suffixes=(" (books)", " (2B)"))
+    exact["Match"] = "Invoice number"
+
+    # Pass 2: what is left, on GSTIN + the invoice number's digits, amounts within tolerance
+    left_books = books[~books["_b"].isin(exact["_b"])]
+    left_books = left_books.assign(core=_invoice_core(left_books["Invoice number"])).dropna(subset=["core"])
+    left_twob = twob[~twob["_t"].isin(exact["_t"])]
+    left_twob = left_twob.assign(core=_invoice_core(left_twob["Invoice number"])).dropna(subset=["core"])
+    fuzzy = left_books.merge(left_twob, on=["gstin", "core"], suffixes=(" (books)", " (2B)"))
+    closeness = ((fuzzy["Taxable Value (₹) (books)"] - fuzzy["Taxable Value (₹) (2B)"]).abs()
+                 + (fuzzy["Total Tax (₹) (books)"] - fuzzy["Total Tax (₹) (2B)"]).abs())
+    fuzzy = fuzzy[closeness <= tol].assign(_closeness=closeness)
+    fuzzy = (fuzzy.sort_values("_closeness", kind="stable")
+             .drop_duplicates("_b").drop_duplicates("_t").drop(columns="_closeness"))
+    fuzzy["Match"] = "GSTIN + amount (invoice number differs)"
+
+    pairs = _compare(pd.concat([exact, fuzzy], ignore_index=True), tol, days)
+    ok = pairs["Reason"] == ""
+    shown = ["GSTIN of supplier (2B)", "Trade/Legal name (2B)", "Invoice number (books)", "Invoice number (2B)",
+             "Invoice Date (books)", "Invoice Date (2B)", "Taxable Value (₹) (books)", "Taxable Value (₹) (2B)",
+             "Total Tax (₹) (books)", "Total Tax (₹) (2B)", "Taxable diff (₹)", "Tax diff (₹)", "Date diff (days)"]
+    shown += [c for c in ("Month", "ITC Availability") if c in pairs.columns] + ["Match"]
+    matched = pairs.loc[ok, shown].rename(columns={"GSTIN of supplier (2B)": "GSTIN of supplier",
+                                                   "Trade/Legal name (2B)": "Trade/Legal name"})
+    mismatched = pairs.loc[~ok, shown + ["Reason"]].rename(columns={"GSTIN of supplier (2B)": "GSTIN of supplier",
+                                                                    "Trade/Legal name (2B)": "Trade/Legal name"})
+
+    side = ["GSTIN of supplier", "Trade/Legal name", "Invoice number", "Invoice Date"] + RECON_AMOUNTS + ["Total Tax (₹)"]
+    missing_in_books = twob.loc[~twob["_t"].isin(pairs["_t"]),
+                                side + [c for c in ("Month", "ITC Availability") if c in twob.columns]]
+    missing_in_2b = books.loc[~books["_b"].isin(pairs["_b"]), side]
+
+    summary = pd.DataFrame({
+        "Status": ["Matched", "Mismatched", "Missing in books", "Missing in 2B"],
+        "Invoices": [len(matched), len(mismatched), len(missing_in_books), len(missing_in_2b)],
+        "Tax as per 2B (₹)": [matched["Total Tax (₹) (2B)"].sum(), mismatched["Total Tax (₹) (2B)"].sum(),
+                              missing_in_books["Total Tax (₹)"].sum(), 0.0],
+        "Tax as per books (₹)": [matched["Total Tax (₹) (books)"].sum(), mismatched["Total Tax (₹) (books)"].sum(),
+                                 0.0, missing_in_2b["Total Tax (₹)"].sum()],
+    })
+    return {"Summary": summary, "Matched": matched, "Mismatched": mismatched,
+            "Missing in books": missing_in_books, "Missing in 2B": missing_in_2b}
+
+
+def write_reconciliation(result: dict, out_path: Path) -> Path:
+    from openpyxl import Workbook
+
+    out = Workbook(write_only=True)
+    for name, df in result.items():
+        ws = out.create_sheet(name)
+        ws.append(list(df.columns))
+        for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+            ws.append(list(row))
+    out.save(out_path)
+    return out_path
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# gstr2b_main reads these at import time: keep the tests off ~/.gstr2b_cache
+_SCRATCH = Path(tempfile.mkdtemp(prefix="gstr2b-tests-"))
+os.environ.setdefault("GSTR2B_JOB_STORE", "memory")
+os.environ.setdefault("GSTR2B_ARTIFACT_STORE", str(_SCRATCH / "artifacts"))
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
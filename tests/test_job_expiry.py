@@ -0,0 +1,70 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+import gstr2b_main
+import job_store
+from job_store import JOB_INTERRUPTED, SqliteJobStore, _HOSTNAME
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    store = SqliteJobStore(tmp_path / "jobs.sqlite3")
+    monkeypatch.setattr(gstr2b_main, "JOB_STORE", store)
+    return store
+
+
+def _job_files(tmp_path, client="ACME", fy="2024-25"):
+    folder = tmp_path / "clients" / client / fy
+    folder.mkdir(parents=True)
+    (folder / "April.xlsx").write_bytes(b"x")
+    zip_path = tmp_path / f"{client}_{fy}.zip"
+    zip_path.write_bytes(b"zip")
+    status = {"status": "COMPLETED", "base_path": str(tmp_path / "clients"), "client": client, "fy": fy,
+              "zip_path": str(zip_path)}
+    return status, folder, zip_path
+
+
+def test_remove_job_files_deletes_zip_and_fy_folder(tmp_path):
+    status, folder, zip_path = _job_files(tmp_path)
+    gstr2b_main.remove_job_files(status)
+    assert not zip_path.exists()
+    assert not folder.exists()
+
+
+def test_remove_job_files_keeps_a_folder_written_since(tmp_path):
+    status, folder, zip_path = _job_files(tmp_path)
+    gstr2b_main.remove_job_files(status, before=time.time() - 60)
+    assert not zip_path.exists()
+    assert folder.exists()
+
+
+def test_remove_job_files_without_paths_only_drops_zips(tmp_path):
+    status, folder, zip_path = _job_files(tmp_path)
+    gstr2b_main.remove_job_files({"zip_path": str(zip_path), "client": "ACME"})
+    assert not zip_path.exists()
+    assert folder.exists()
+
+
+def test_expire_jobs_forgets_old_finished_jobs(store, tmp_path):
+    status, folder, zip_path = _job_files(tmp_path)
+    store.save("old", status)
+    gstr2b_main.expire_jobs(now=time.time() + gstr2b_main.JOB_TTL_SECONDS + 1)
+    assert store.load("old") is None
+    assert not zip_path.exists()
+    assert not folder.exists()
+
+
+def test_recover_jobs_interrupts_orphans(store, monkeypatch):
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    monkeypatch.setattr(job_store, "_job_owner", lambda: f"{_HOSTNAME}:{proc.pid}")
+    store.save("orphan", {"status": "RUNNING", "months": {"April": "RUNNING"}})
+    monkeypatch.undo()
+    monkeypatch.setattr(gstr2b_main, "JOB_STORE", store)
+    store.save("live", {"status": "RUNNING"})
+    gstr2b_main.recover_jobs()
+    assert store.load("orphan")[1]["status"] == JOB_INTERRUPTED
+    assert store.load("live")[1]["status"] == "RUNNING"
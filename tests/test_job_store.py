@@ -0,0 +1,107 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+import job_store
+from job_store import JOB_INTERRUPTED, MONTH_COMPLETED, MONTH_PENDING, JobStore, SqliteJobStore, _HOSTNAME
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return JobStore() if request.param == "memory" else SqliteJobStore(tmp_path / "jobs.sqlite3")
+
+
+@pytest.fixture
+def dead_owner(monkeypatch):
+    """Make saves look like they came from a process on this host that has since exited."""
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    monkeypatch.setattr(job_store, "_job_owner", lambda: f"{_HOSTNAME}:{proc.pid}")
+
+
+def _running_status():
+    return {"status": "RUNNING", "stage": "DOWNLOADING", "captcha": "abc",
+            "months": {"April": MONTH_COMPLETED, "May": "RUNNING", "June": "FAILED"}}
+
+
+def test_save_and_load_bump_version(store):
+    assert store.load("j1") is None
+    store.save("j1", {"status": "RUNNING"})
+    store.save("j1", {"status": "COMPLETED"})
+    version, status = store.load("j1")
+    assert version == 2
+    assert status == {"status": "COMPLETED"}
+    store.delete("j1")
+    assert store.load("j1") is None
+
+
+def test_save_spec_alone_is_not_a_job(store):
+    store.save_spec("j1", "single", {"client": "ACME"})
+    assert store.load("j1") is None
+
+
+def test_expired_only_returns_old_finished_jobs(store):
+    store.save("done", {"status": "COMPLETED", "zip_path": "x.zip"})
+    store.save("failed", {"status": "FAILED"})
+    store.save("running", {"status": "RUNNING"})
+    assert store.expired(time.time() - 60) == []
+    expired = dict(store.expired(time.time() + 1))
+    assert set(expired) == {"done", "failed"}
+    assert expired["done"]["zip_path"] == "x.zip"
+
+
+def test_commands_are_taken_once(store):
+    store.post_command("j1", "captcha", {"text": "abc"})
+    store.post_command("j2", "cancel")
+    assert store.take_commands(["j1"]) == [("j1", "captcha", {"text": "abc"})]
+    assert store.take_commands(["j1"]) == []
+    assert store.take_commands(["j2"]) == [("j2", "cancel", None)]
+
+
+def test_claim_queued_by_priority_then_order(store):
+    store.enqueue("low", 0, "single", {})
+    store.enqueue("high", 10, "single", {})
+    store.enqueue("low2", 0, "single", {})
+    assert store.queue_position("low") == 2
+    assert [store.claim_queued()[0] for _ in range(3)] == ["high", "low", "low2"]
+    assert store.claim_queued() is None
+
+
+def test_claim_orphans_interrupts_jobs_of_dead_processes(tmp_path, dead_owner):
+    store = SqliteJobStore(tmp_path / "jobs.sqlite3")
+    store.save("orphan", _running_status())
+    store.save("finished", {"status": "COMPLETED"})
+    assert store.claim_orphans() == ["orphan"]
+    assert store.claim_orphans() == []
+    _, status = store.load("orphan")
+    assert status["status"] == JOB_INTERRUPTED
+    assert status["months"] == {"April": MONTH_COMPLETED, "May": MONTH_PENDING, "June": MONTH_PENDING}
+    assert "captcha" not in status
+
+
+def test_claim_orphans_skips_live_processes(tmp_path):
+    store = SqliteJobStore(tmp_path / "jobs.sqlite3")
+    store.save("mine", _running_status())
+    assert store.claim_orphans() == []
+
+
+def test_claim_resume_requeues_an_interrupted_job(tmp_path, dead_owner):
+    store = SqliteJobStore(tmp_path / "jobs.sqlite3")
+    store.save("j1", _running_status())
+    store.save_spec("j1", "single", {"client": "ACME"})
+    assert store.claim_resume("j1") is None   # not interrupted yet
+    store.claim_orphans()
+    status, kind, spec = store.claim_resume("j1")
+    assert (status["status"], kind, spec) == ("QUEUED", "single", {"client": "ACME"})
+    assert "error" not in status
+    assert store.claim_resume("j1") is None
+    assert store.expired(time.time() + 1) == []
+
+
+def test_claim_resume_needs_a_spec(tmp_path, dead_owner):
+    store = SqliteJobStore(tmp_path / "jobs.sqlite3")
+    store.save("j1", _running_status())
+    store.claim_orphans()
+    assert store.claim_resume("j1") is None
@@ -0,0 +1,15 @@
+import pytest
+
+from gstr2b_main import _infer_month_from_filename
+
+
+@pytest.mark.parametrize("name, month", [
+    ("GSTR2B_April_2024-25.xlsx", "April"),
+    ("gstr2b-march-2024-25.xlsx", "March"),
+    ("052024_27AAAAA0001A1Z5_GSTR2B_16062024.xlsx", "May"),
+    ("012025_27AAAAA0001A1Z5_GSTR2B.xlsx", "January"),
+    ("032024_27APRIL1234F1Z5_GSTR2B.xlsx", "March"),   # the PAN spells a month
+    ("Summary.xlsx", ""),
+])
+def test_infer_month_from_filename(name, month):
+    assert _infer_month_from_filename(name) == month
@@ -0,0 +1,19 @@
+import pytest
+
+import gstr2b_main
+from gstr2b_main import parse_tabs
+
+
+@pytest.mark.parametrize("value, tabs", [(None, None), ("", None), (1, 1), ("3", 3), (4.0, 4)])
+def test_valid_tabs(value, tabs):
+    assert parse_tabs(value) == tabs
+
+
+@pytest.mark.parametrize("value", [0, -1, gstr2b_main.MULTI_TAB_MAX + 1, True, 2.5, "two"])
+def test_invalid_tabs(value):
+    with pytest.raises(ValueError):
+        parse_tabs(value)
+
+
+def test_max_tabs_is_allowed():
+    assert parse_tabs(gstr2b_main.MULTI_TAB_MAX) == gstr2b_main.MULTI_TAB_MAX
@@ -0,0 +1,63 @@
+import pandas as pd
+
+from reconciliation import reconcile_itc
+
+GSTIN = "27AAAAA0001A1Z5"
+
+
+def _rows(rows):
+    return pd.DataFrame([{"GSTIN of supplier": gstin, "Trade/Legal name": "Supplier", "Invoice number": inv,
+                          "Invoice Date": pd.Timestamp(day), "Taxable Value (₹)": taxable,
+                          "Integrated Tax (₹)": 0.0, "Central Tax (₹)": tax / 2, "State/UT Tax (₹)": tax / 2,
+                          "Cess (₹)": 0.0} for gstin, inv, day, taxable, tax in rows])
+
+
+def _reconcile():
+    b2b = _rows([
+        (GSTIN, "INV/001", "2023-04-10", 1000.0, 180.0),
+        (GSTIN, "INV/002", "2023-04-11", 2000.0, 360.0),
+        (GSTIN, "45", "2023-04-12", 500.0, 90.0),
+        (GSTIN, "INV/009", "2023-04-13", 700.0, 126.0),
+    ])
+    register = _rows([
+        (GSTIN.lower(), "inv-0001", "2023-04-10", 1000.0, 180.0),
+        (GSTIN, "INV/002", "2023-04-11", 2500.0, 360.0),
+        (GSTIN, "GST/2023-24/0045", "2023-04-12", 500.5, 90.0),
+        (GSTIN, "INV/008", "2023-04-14", 300.0, 54.0),
+    ])
+    return reconcile_itc(b2b, register)
+
+
+def test_buckets():
+    result = _reconcile()
+    assert set(result) == {"Summary", "Matched", "Mismatched", "Missing in books", "Missing in 2B"}
+    summary = result["Summary"].set_index("Status")["Invoices"].to_dict()
+    assert summary == {"Matched": 2, "Mismatched": 1, "Missing in books": 1, "Missing in 2B": 1}
+
+
+def test_matched_on_invoice_number_and_on_amount():
+    matched = _reconcile()["Matched"].set_index("Invoice number (2B)")
+    assert matched.loc["INV/001", "Match"] == "Invoice number"
+    assert matched.loc["45", "Match"] == "GSTIN + amount (invoice number differs)"
+    assert matched.loc["45", "Invoice number (books)"] == "GST/2023-24/0045"
+
+
+def test_mismatch_reason():
+    mismatched = _reconcile()["Mismatched"]
+    assert list(mismatched["Invoice number (2B)"]) == ["INV/002"]
+    assert mismatched["Reason"].iloc[0] == "Taxable value"
+    assert mismatched["Taxable diff (₹)"].iloc[0] == 500.0
+
+
+def test_missing_on_either_side():
+    result = _reconcile()
+    assert list(result["Missing in books"]["Invoice number"]) == ["INV/009"]
+    assert list(result["Missing in 2B"]["Invoice number"]) == ["INV/008"]
+
+
+def test_tolerances():
+    b2b = _rows([(GSTIN, "INV/1", "2023-04-10", 1000.0, 180.0)])
+    register = _rows([(GSTIN, "INV/1", "2023-04-20", 1000.8, 180.0)])
+    assert len(reconcile_itc(b2b, register)["Mismatched"]) == 1   # 10 days apart
+    assert len(reconcile_itc(b2b, register, date_tolerance_days=10)["Matched"]) == 1
+    assert len(reconcile_itc(b2b, register, amount_tolerance=0.5, date_tolerance_days=10)["Mismatched"]) == 1
@@ -0,0 +1,44 @@
+import pytest
+
+import gstr2b_main
+from gstr2b_main import app, request_priority
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(gstr2b_main, "PRIORITY_TOKEN", "s3cret")
+    monkeypatch.setattr(gstr2b_main, "MAX_CLIENT_PRIORITY", 1)
+    return "s3cret"
+
+
+def _priority(data, headers=None):
+    with app.test_request_context("/run-gstr2b", method="POST", headers=headers or {}):
+        return request_priority(data)
+
+
+def test_default_is_zero(token):
+    assert _priority({}) == 0
+    assert _priority({"priority": None}) == 0
+
+
+def test_untrusted_callers_are_capped(token):
+    assert _priority({"priority": 5}) == 1
+    assert _priority({"priority": "5"}, {"X-Priority-Token": "wrong"}) == 1
+    assert _priority({"priority": -3}) == -3
+
+
+def test_token_lifts_the_cap(token):
+    assert _priority({"priority": 5}, {"X-Priority-Token": token}) == 5
+    assert _priority({"priority": 7.0}, {"X-Priority-Token": token}) == 7
+
+
+def test_no_token_configured_caps_everyone(monkeypatch):
+    monkeypatch.setattr(gstr2b_main, "PRIORITY_TOKEN", "")
+    monkeypatch.setattr(gstr2b_main, "MAX_CLIENT_PRIORITY", 0)
+    assert _priority({"priority": 5}, {"X-Priority-Token": ""}) == 0
+
+
+@pytest.mark.parametrize("value", [True, 1.5, "high"])
+def test_invalid_priority(token, value):
+    with pytest.raises(ValueError):
+        _priority({"priority": value})
@@ -0,0 +1,64 @@
+import io
+import zipfile
+
+import pytest
+
+import zip_artifacts
+from zip_artifacts import _zip_entries, _zip_plan, plan_zip, stream_zip, write_zip, zip_available
+
+
+@pytest.fixture
+def folder(tmp_path):
+    fy = tmp_path / "ACME" / "2024-25"
+    fy.mkdir(parents=True)
+    (fy / "April.xlsx").write_bytes(b"PK" + bytes(range(256)) * 64)
+    (fy / "notes.csv").write_text("gstin,amount\n" * 500)
+    return fy
+
+
+def _read(data: bytes) -> dict:
+    with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+        assert zipf.testzip() is None
+        return {info.filename: (info.compress_type, zipf.read(info)) for info in zipf.infolist()}
+
+
+def test_write_zip_stores_compressed_members(folder, tmp_path):
+    zip_path = write_zip(tmp_path / "out.zip", _zip_entries(folder.parent, [folder.name], folder))
+    members = _read(zip_path.read_bytes())
+    assert members["April.xlsx"][0] == zipfile.ZIP_STORED
+    assert members["notes.csv"][0] == zipfile.ZIP_DEFLATED
+
+
+def test_stream_zip_yields_the_archive_it_writes(folder, tmp_path):
+    entries = _zip_entries(folder.parent, [folder.name], folder)
+    zip_path = tmp_path / "out.zip"
+    streamed = b"".join(stream_zip(entries, zip_path))
+    assert streamed == zip_path.read_bytes()
+    assert _read(streamed) == _read(write_zip(tmp_path / "plain.zip", entries).read_bytes())
+    assert not (tmp_path / "out.zip.part").exists()
+
+
+def test_stream_zip_finishes_the_file_after_a_disconnect(folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(zip_artifacts, "ZIP_STREAM_CHUNK", 1024)
+    zip_path = tmp_path / "out.zip"
+    stream = stream_zip(_zip_entries(folder.parent, [folder.name], folder), zip_path)
+    next(stream)
+    stream.close()
+    assert set(_read(zip_path.read_bytes())) == {"April.xlsx", "notes.csv"}
+
+
+def test_stream_zip_streams_only_while_another_worker_writes(folder, tmp_path):
+    zip_path = tmp_path / "out.zip"
+    (tmp_path / "out.zip.part").write_bytes(b"")
+    streamed = b"".join(stream_zip(_zip_entries(folder.parent, [folder.name], folder), zip_path))
+    assert len(_read(streamed)) == 2
+    assert not zip_path.exists()
+
+
+def test_planned_zip_is_available_to_other_workers(folder, tmp_path):
+    zip_path = tmp_path / "planned.zip"
+    plan_zip(zip_path, folder.parent, [folder.name], folder)
+    assert zip_available(zip_path)
+    zip_artifacts.PLANNED_ZIPS.clear()   # as seen from another process
+    plan = _zip_plan(zip_path)
+    assert (plan["parent"], plan["names"], plan["base"]) == (folder.parent, [folder.name], folder)
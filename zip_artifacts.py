@@ -0,0 +1,133 @@
+"""
+Zip artifacts of the GSTR-2B service: writing a job's folders into a zip,
+planning one to be built on the first download, and streaming it while it
+is built.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+
+# Members that are already compressed (xlsx and parquet are zip / columnar
+# containers, png is deflated) are stored as they are; deflating them again
+# costs CPU for a percent or two of size. With ZIP_ON_DOWNLOAD the archive is
+# not built when the job finishes: /download writes it to disk and streams
+# each member to the client as soon as it is complete, so later requests
+# (and resumed ones) are served from the finished file with Range support.
+# The archive is always written to a seekable file: zipfile then patches CRC
+# and sizes into each local header instead of appending a data descriptor,
+# which some extractors reject after a STORED member.
+STORED_SUFFIXES = {".xlsx", ".xlsm", ".xls", ".zip", ".parquet", ".png", ".jpg", ".jpeg", ".gz"}
+ZIP_ON_DOWNLOAD = os.environ.get("GSTR2B_ZIP_ON_DOWNLOAD", "1") == "1"
+ZIP_STREAM_CHUNK = 1024 * 1024
+PLANNED_ZIPS = {}   # str(zip_path) -> {"parent", "names", "base", "lock"}; also in <zip>.plan for other workers
+
+
+def _zip_entries(parent: Path, names: list, base: Path) -> list:
+    """(path, arcname) of every file under parent/<name>, arcnames relative to `base`."""
+    entries = []
+    for name in names:
+        for root, dirs, files in os.walk(parent / name):
+            for file in files:
+                full_path = os.path.join(root, file)
+                entries.append((full_path, os.path.relpath(full_path, base)))
+    return entries
+
+
+def _zip_info(path, arcname) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo.from_file(path, arcname)
+    info.compress_type = zipfile.ZIP_STORED if Path(path).suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+    return info
+
+
+def write_zip(zip_path: Path, entries: list) -> Path:
+    with zipfile.ZipFile(zip_path, "w") as zipf:
+        for full_path, arcname in entries:
+            with open(full_path, "rb") as src, zipf.open(_zip_info(full_path, arcname), "w") as dst:
+                shutil.copyfileobj(src, dst, ZIP_STREAM_CHUNK)
+    return zip_path
+
+
+def plan_zip(zip_path: Path, parent: Path, names: list, base: Path) -> Path:
+    """Record what zip_path will hold, for stream_zip to build on the first download."""
+    PLANNED_ZIPS[str(zip_path)] = {"parent": parent, "names": list(names), "base": base, "lock": threading.Lock()}
+    Path(f"{zip_path}.plan").write_text(json.dumps({"parent": str(parent), "names": list(names), "base": str(base)}))
+    return zip_path
+
+
+def _zip_plan(zip_path: Path):
+    """The plan of a zip not built yet: this process's, or one left on disk by another worker."""
+    plan = PLANNED_ZIPS.get(str(zip_path))
+    sidecar = Path(f"{zip_path}.plan")
+    if plan is None and sidecar.exists():
+        spec = json.loads(sidecar.read_text())
+        plan = PLANNED_ZIPS.setdefault(str(zip_path), {"parent": Path(spec["parent"]), "names": spec["names"],
+                                                       "base": Path(spec["base"]), "lock": threading.Lock()})
+    return plan
+
+
+def zip_available(zip_path) -> bool:
+    return bool(zip_path) and (os.path.exists(zip_path) or str(zip_path) in PLANNED_ZIPS
+                               or os.path.exists(f"{zip_path}.plan"))
+
+
+def _read_up_to(reader, end: int):
+    """Yield what `reader` has between its position and `end`, ZIP_STREAM_CHUNK at a time."""
+    while reader.tell() < end:
+        yield reader.read(min(ZIP_STREAM_CHUNK, end - reader.tell()))
+
+
+def stream_zip(entries: list, zip_path: Path = None):
+    """
+    Build the zip of `entries` on disk and yield its bytes as each member is
+    finished. With `zip_path` the archive is written to zip_path (through a
+    .part file), otherwise to a scratch file. If the client disconnects, the
+    archive is still finished on disk.
+    """
+    part = Path(f"{zip_path}.part") if zip_path else None
+    scratch = None
+    try:
+        out = open(part, "xb") if part else None
+    except FileExistsError:
+        out = None   # another worker is writing the artifact; stream only
+    if out is None:
+        part = None
+        fd, scratch = tempfile.mkstemp(suffix=".zip")
+        scratch = Path(scratch)
+        out = os.fdopen(fd, "wb")
+    reader = open(part or scratch, "rb")
+    streaming = True
+    try:
+        with zipfile.ZipFile(out, "w") as zipf:
+            for full_path, arcname in entries:
+                with open(full_path, "rb") as src, zipf.open(_zip_info(full_path, arcname), "w") as dst:
+                    shutil.copyfileobj(src, dst, ZIP_STREAM_CHUNK)
+                if not streaming:
+                    continue
+                # Everything up to here is final: the member's header has its CRC and sizes now
+                out.flush()
+                try:
+                    yield from _read_up_to(reader, out.tell())
+                except GeneratorExit:
+                    streaming = False   # finish the file on disk, but yield nothing more
+                    if not part:
+                        return
+        out.close()
+        tail = reader.read() if streaming else b""   # the central directory
+        reader.close()
+        if part:
+            os.replace(part, zip_path)
+        if tail:
+            yield tail
+    finally:
+        reader.close()
+        if not out.closed:
+            out.close()
+        if part and part.exists():
+            part.unlink(missing_ok=True)   # build failed half way
+        if scratch:
+            scratch.unlink(missing_ok=True)